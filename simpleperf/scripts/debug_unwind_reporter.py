@@ -38,77 +38,140 @@
 
 from __future__ import print_function
 import argparse
+import array
 import bisect
 import collections
-import copy
 import re
 import subprocess
+import sys
 
 from utils import *
 
+# Filenames and function names repeat in many records. Intern them to share the strings.
+intern_str = sys.intern if is_python3() else intern
+
+FUNC_RE = re.compile(r'(.+)\[\+(\w+)\]\)')
+DELETED_RE = re.compile(r'\)\[\+\w+\]\)$')
+MMAP_RE = re.compile(r'pid\s+(\d+).+addr\s+0x(\w+).+len\s+0x(\w+)')
+FORK_RE = re.compile(r'pid\s+(\w+),\s+ppid\s+(\w+)')
+# Files containing code generated in memory.
+JIT_CODE_FILE_RE = re.compile(
+    r'/dev/ashmem/dalvik-jit-code-cache|\[anon:dalvik-jit-code-cache\]|//anon')
+
+# Functions in libc.so that complete callchains reach.
+CALLCHAIN_ROOT_FUNCTIONS = frozenset(['__libc_init', '__start_thread'])
+
+# array.array typecode for 64-bit addrs. Python2 doesn't support 'Q', and its 'L' is 32-bit on
+# Windows, where lists are used instead.
+if is_python3():
+    ADDR_TYPECODE = 'Q'
+elif array.array('L').itemsize >= 8:
+    ADDR_TYPECODE = 'L'
+else:
+    ADDR_TYPECODE = None
+
+
+def new_addr_array(addrs=()):
+    """ Return a packed array of addrs, which takes less memory than a list of ints. """
+    return array.array(ADDR_TYPECODE, addrs) if ADDR_TYPECODE else list(addrs)
+
 
 class MapEntry(object):
 
+    __slots__ = ('start', 'end', 'filename')
+
     def __init__(self, start, end, filename):
         self.start = start
         self.end = end
         self.filename = filename
 
-    def __lt__(self, other):
-        return self.start < other.start
 
 class ProcessMaps(object):
 
     def __init__(self):
-        self.process_maps = {}  # map from pid to a sorted list of MapEntry.
+        # map from pid to a tuple of (starts, ends, filenames), sorted by start addr. starts and
+        # ends are addr arrays, filenames is a list.
+        self.process_maps = {}
+        # pids sharing their maps with other pids after fork. Their maps are copied on next add.
+        self.shared_pids = set()
 
     def add(self, pid, map_entry):
-        old_list = self.process_maps.get(pid, [])
-        new_list = []
-        map_entry_used = False
-        for entry in old_list:
-            if entry.end <= map_entry.start:
-                new_list.append(entry)
-            elif entry.start < map_entry.start:
-                entry.end = map_entry.start
-                new_list.append(entry)
-            else:
-                if not map_entry_used:
-                    new_list.append(map_entry)
-                    map_entry_used = True
-                if entry.start >= map_entry.end:
-                    new_list.append(entry)
-                elif entry.end > map_entry.end:
-                    entry.start = map_entry.end
-                    new_list.append(entry)
-        if not map_entry_used:
-            new_list.append(map_entry)
-        self.process_maps[pid] = new_list
+        maps = self.process_maps.get(pid)
+        if maps is None:
+            maps = self.process_maps[pid] = (new_addr_array(), new_addr_array(), [])
+        elif pid in self.shared_pids:
+            maps = self.process_maps[pid] = (maps[0][:], maps[1][:], maps[2][:])
+            self.shared_pids.remove(pid)
+        starts, ends, filenames = maps
+        if not ends or ends[-1] <= map_entry.start:
+            # Maps are usually added in address order, so map_entry can be appended directly.
+            starts.append(map_entry.start)
+            ends.append(map_entry.end)
+            filenames.append(map_entry.filename)
+            return
+        pos = bisect.bisect_left(starts, map_entry.start)
+        # Truncate the map starting before map_entry if they overlap.
+        if pos > 0 and ends[pos - 1] > map_entry.start:
+            ends[pos - 1] = map_entry.start
+        # Remove maps covered by map_entry, and trim the last one partly covered by it.
+        end_pos = pos
+        while end_pos < len(starts) and starts[end_pos] < map_entry.end:
+            if ends[end_pos] > map_entry.end:
+                starts[end_pos] = map_entry.end
+                break
+            end_pos += 1
+        starts[pos:end_pos] = new_addr_array([map_entry.start])
+        ends[pos:end_pos] = new_addr_array([map_entry.end])
+        filenames[pos:end_pos] = [map_entry.filename]
 
     def fork_pid(self, pid, ppid):
         if pid == ppid:
             return
-        entry_list = self.process_maps.get(ppid, [])
-        self.process_maps[pid] = copy.deepcopy(entry_list)
+        maps = self.process_maps.get(ppid)
+        if maps is None:
+            self.process_maps[pid] = (new_addr_array(), new_addr_array(), [])
+            self.shared_pids.discard(pid)
+        else:
+            self.process_maps[pid] = maps
+            self.shared_pids.add(pid)
+            self.shared_pids.add(ppid)
 
     def find(self, pid, addr):
-        key = MapEntry(addr, addr, '')
-        entry_list = self.process_maps.get(pid, [])
-        pos = bisect.bisect_right(entry_list, key)
-        if pos > 0 and entry_list[pos - 1].end > addr:
-            return entry_list[pos - 1]
+        """ Return (start, end, filename) of the map containing addr, or None. """
+        maps = self.process_maps.get(pid)
+        if maps:
+            starts, ends, filenames = maps
+            pos = bisect.bisect_right(starts, addr)
+            if pos > 0 and ends[pos - 1] > addr:
+                return starts[pos - 1], ends[pos - 1], filenames[pos - 1]
         return None
 
+    def find_all(self, pid, addrs):
+        """ Return the result of find() for each addr in addrs. """
+        result = [None] * len(addrs)
+        maps = self.process_maps.get(pid)
+        if maps:
+            starts, ends, filenames = maps
+            # Look up addrs in increasing order, so each search can start from the last position.
+            pos = 0
+            for i in sorted(range(len(addrs)), key=addrs.__getitem__):
+                addr = addrs[i]
+                pos = bisect.bisect_right(starts, addr, pos)
+                if pos > 0 and ends[pos - 1] > addr:
+                    result[i] = (starts[pos - 1], ends[pos - 1], filenames[pos - 1])
+        return result
+
     def show(self):
         for pid in sorted(self.process_maps):
             print('  pid %d' % pid)
-            for entry in self.process_maps[pid]:
-                print('    map [%x-%x] %s' %
-                      (entry.start, entry.end, entry.filename))
+            for start, end, filename in zip(*self.process_maps[pid]):
+                print('    map [%x-%x] %s' % (start, end, filename))
 
 
 class UnwindingTimes(object):
 
+    __slots__ = ('total_time', 'count', 'max_time')
+
     def __init__(self):
         self.total_time = 0
         self.count = 0
@@ -127,29 +190,28 @@ class UnwindingMemConsumption(object):
         self.after_unwinding = None
 
 
-class CallChainNode(object):
+class CallChainNode(collections.namedtuple('CallChainNode', [
+        'ip', 'sp', 'filename', 'vaddr_in_file', 'function_name', 'map_start_addr',
+        'map_end_addr'])):
 
     """ Representing a node in a call chain."""
 
-    def __init__(self, ip, sp, filename, vaddr_in_file, function_name, map_start_addr,
-                 map_end_addr):
-        self.ip = ip
-        self.sp = sp
-        self.filename = filename
-        self.vaddr_in_file = vaddr_in_file
-        self.function_name = function_name
-        self.map_start_addr = map_start_addr
-        self.map_end_addr = map_end_addr
+    __slots__ = ()
 
 
 class SampleResult(object):
 
     """ Unwinding result per sample. """
 
+    __slots__ = ('pid', 'tid', 'unwinding_result', 'used_time', 'stop_reason', 'callchain',
+                 'sample_record')
+
     def __init__(self, pid, tid, unwinding_result, callchain, sample_record):
         self.pid = pid
         self.tid = tid
         self.unwinding_result = unwinding_result
+        self.used_time = unwinding_result['used_time']
+        self.stop_reason = unwinding_result['stop_reason']
         self.callchain = callchain
         self.sample_record = sample_record
 
@@ -174,20 +236,24 @@ class FunctionResult(object):
 
     def __init__(self):
         # Map from Unwinding result reason to [SampleResult].
-        self.sample_results = {}
+        self.sample_results = collections.defaultdict(list)
+        # Map from Unwinding result reason to vaddr_in_file of the top nodes of the callchains in
+        # stored SampleResults.
+        self.sample_vaddrs = collections.defaultdict(set)
 
     def add_sample_result(self, sample_result):
-        stop_reason = sample_result.unwinding_result['stop_reason']
-        result_list = self.sample_results.get(stop_reason)
-        if not result_list:
-            result_list = self.sample_results[stop_reason] = []
-        for result in result_list:
-            if result.callchain[-1].vaddr_in_file == sample_result.callchain[-1].vaddr_in_file:
-                # This sample_result duplicates with an existing one.
-                return
+        stop_reason = sample_result.stop_reason
+        result_list = self.sample_results[stop_reason]
         # We don't want to store too many sample results for a function.
-        if len(result_list) < 10:
-            result_list.append(sample_result)
+        if len(result_list) >= 10:
+            return
+        vaddr_in_file = sample_result.callchain[-1].vaddr_in_file
+        vaddrs = self.sample_vaddrs[stop_reason]
+        if vaddr_in_file in vaddrs:
+            # This sample_result duplicates with an existing one.
+            return
+        vaddrs.add(vaddr_in_file)
+        result_list.append(sample_result)
 
     def show(self):
         for stop_reason in sorted(self.sample_results):
@@ -200,15 +266,12 @@ class FileResult(object):
     """ Unwinding result per shared library. """
 
     def __init__(self):
-        self.function_results = {}  # Map from function_name to FunctionResult.
+        # Map from function_name to FunctionResult.
+        self.function_results = collections.defaultdict(FunctionResult)
 
     def add_sample_result(self, sample_result):
         function_name = sample_result.callchain[-1].function_name
-        function_result = self.function_results.get(function_name)
-        if not function_result:
-            function_result = self.function_results[
-                function_name] = FunctionResult()
-        function_result.add_sample_result(sample_result)
+        self.function_results[function_name].add_sample_result(sample_result)
 
     def show(self):
         for function_name in sorted(self.function_results):
@@ -217,6 +280,15 @@ class FileResult(object):
             print('\n')
 
 
+def is_callchain_complete(callchain):
+    # The root functions are at the end of complete callchains.
+    for node in reversed(callchain):
+        if (node.function_name in CALLCHAIN_ROOT_FUNCTIONS and
+                node.filename.endswith('libc.so')):
+            return True
+    return False
+
+
 class UnwindingResultErrorReport(object):
 
     """ Report time used for unwinding and unwinding result errors. """
@@ -226,17 +298,16 @@ class UnwindingResultErrorReport(object):
         self.process_maps = ProcessMaps()
         self.unwinding_times = UnwindingTimes()
         self.mem_stat = UnwindingMemConsumption()
-        self.file_results = {}  # map from filename to FileResult.
+        self.file_results = collections.defaultdict(FileResult)  # map from filename to FileResult.
+        self.sorted_filenames = None  # sorted keys of file_results, computed in show().
 
     def add_sample_result(self, sample_result, joined_record):
-        self.unwinding_times.add_time(int(sample_result.unwinding_result['used_time']))
+        self.unwinding_times.add_time(sample_result.used_time)
         if self.should_omit(sample_result, joined_record):
             return
         filename = sample_result.callchain[-1].filename
-        file_result = self.file_results.get(filename)
-        if not file_result:
-            file_result = self.file_results[filename] = FileResult()
-        file_result.add_sample_result(sample_result)
+        self.file_results[filename].add_sample_result(sample_result)
+        self.sorted_filenames = None
 
     def add_mem_stat(self, name, mem_str):
         # mem_str is like VmPeak:202464 kB;VmSize:183456 kB;VmHWM:98256 kB;VmRSS:33680 kB.
@@ -251,17 +322,10 @@ class UnwindingResultErrorReport(object):
 
     def should_omit(self, sample_result, joined_record):
         # 1. Can't unwind code generated in memory.
-        for name in ['/dev/ashmem/dalvik-jit-code-cache', '[anon:dalvik-jit-code-cache]', '//anon']:
-            if name in sample_result.callchain[-1].filename:
-                return True
+        if JIT_CODE_FILE_RE.search(sample_result.callchain[-1].filename):
+            return True
         # 2. Don't report complete callchains, which can reach __libc_init or __start_thread in
         # libc.so.
-        def is_callchain_complete(callchain):
-            for node in callchain:
-                if (node.filename.endswith('libc.so') and
-                        node.function_name in ['__libc_init', '__start_thread']):
-                    return True
-            return False
         if is_callchain_complete(sample_result.callchain):
             return True
         # 3. Omit callchains made complete by callchain joiner.
@@ -283,7 +347,9 @@ class UnwindingResultErrorReport(object):
             print('  %s: %s -> %s' % (items[0][0], items[0][1], items[1][1]))
         print('Process maps:')
         self.process_maps.show()
-        for filename in sorted(self.file_results):
+        if self.sorted_filenames is None:
+            self.sorted_filenames = sorted(self.file_results)
+        for filename in self.sorted_filenames:
             print('filename %s' % filename)
             self.file_results[filename].show()
             print('\n')
@@ -297,20 +363,61 @@ class CallChainRecord(object):
         self.tid = None
         self.callchain = []
 
-def parse_sample_record(lines, i):
+
+class DumpLineReader(object):
+    """ Read dump output line by line, with one line lookahead. """
+
+    def __init__(self, fh):
+        self.fh = fh
+        self.line_num = 0
+        self.next_line = None
+        self._read_next_line()
+
+    def _read_next_line(self):
+        line = self.fh.readline()
+        self.next_line = line.rstrip('\n') if line else None
+
+    def peek(self):
+        """ Return the next line without consuming it, or None at the end of output. """
+        return self.next_line
+
+    def read_line(self):
+        """ Consume and return the next line, or None at the end of output. """
+        line = self.next_line
+        if line is not None:
+            self.line_num += 1
+            self._read_next_line()
+        return line
+
+    def read_record_body(self):
+        """ Yield the lines before the next record line. """
+        # Most lines are read here, so avoid calling other methods per line.
+        readline = self.fh.readline
+        line = self.next_line
+        while line is not None and not line.startswith('record'):
+            self.line_num += 1
+            next_line = readline()
+            self.next_line = next_line.rstrip('\n') if next_line else None
+            yield line
+            line = self.next_line
+
+
+def parse_sample_record(reader):
     """ Read the lines belong to a SampleRecord."""
-    if i == len(lines) or not lines[i].startswith('record sample:'):
-        log_fatal('unexpected dump output near line %d' % i)
-    start_line = i
-    i += 1
-    while i < len(lines) and (not lines[i] or lines[i].startswith(' ')):
-        i += 1
-    return i, lines[start_line:i]
-
-def parse_callchain_record(lines, i, chain_type, process_maps):
-    if i == len(lines) or not lines[i].startswith('record callchain:'):
-        log_fatal('unexpected dump output near line %d' % i)
-    i += 1
+    line = reader.peek()
+    if line is None or not line.startswith('record sample:'):
+        log_fatal('unexpected dump output near line %d' % reader.line_num)
+    lines = [reader.read_line()]
+    line = reader.peek()
+    while line is not None and (not line or line.startswith(' ')):
+        lines.append(reader.read_line())
+        line = reader.peek()
+    return lines
+
+def parse_callchain_record(reader, chain_type, process_maps):
+    line = reader.read_line()
+    if line is None or not line.startswith('record callchain:'):
+        log_fatal('unexpected dump output near line %d' % reader.line_num)
     record = CallChainRecord()
     ips = []
     sps = []
@@ -319,46 +426,51 @@ def parse_callchain_record(lines, i, chain_type, process_maps):
     vaddr_in_files = []
     map_start_addrs = []
     map_end_addrs = []
-    in_callchain = False
-    while i < len(lines) and not lines[i].startswith('record'):
-        line = lines[i].strip()
-        items = line.split()
-        if not items:
-            i += 1
+    lines = reader.read_record_body()
+    for line in lines:
+        line = line.strip()
+        key, _, value = line.partition(' ')
+        if key == 'ip':
+            # "ip 0x7f8d4a3c10, sp 0x7fc9d2a0e0". Parse it without regex, as it appears for
+            # every ip in the callchain.
+            comma_pos = value.find(',')
+            sp_pos = value.find('sp 0x', comma_pos)
+            if value.startswith('0x') and comma_pos > 0 and sp_pos > 0:
+                ips.append(int(value[2:comma_pos], 16))
+                sps.append(int(value[sp_pos + 5:], 16))
+        elif key == 'pid':
+            record.pid = int(value)
+        elif key == 'tid':
+            record.tid = int(value)
+        elif key == 'chain_type':
+            if value != chain_type:
+                log_fatal('unexpected dump output near line %d' % reader.line_num)
+        elif key == 'callchain:':
+            break
+    # The remaining lines are callchain nodes. They are the majority of the dump output, so
+    # look up the functions used per line only once.
+    search_deleted = DELETED_RE.search
+    match_func = FUNC_RE.match
+    for line in lines:
+        line = line.strip()
+        if not line:
             continue
-        if items[0] == 'pid' and len(items) == 2:
-            record.pid = int(items[1])
-        elif items[0] == 'tid' and len(items) == 2:
-            record.tid = int(items[1])
-        elif items[0] == 'chain_type' and len(items) == 2:
-            if items[1] != chain_type:
-                log_fatal('unexpected dump output near line %d' % i)
-        elif items[0] == 'ip':
-            m = re.search(r'ip\s+0x(\w+),\s+sp\s+0x(\w+)$', line)
+        # "dalvik-jit-code-cache (deleted)[+346c] (/dev/ashmem/dalvik-jit-code-cache (deleted)[+346c])"
+        if search_deleted(line):
+            break_pos = line.rfind('(', 0, line.rfind('('))
+        else:
+            break_pos = line.rfind('(')
+        if break_pos > 0:
+            m = match_func(line, break_pos + 1)
             if m:
-                ips.append(int(m.group(1), 16))
-                sps.append(int(m.group(2), 16))
-        elif items[0] == 'callchain:':
-            in_callchain = True
-        elif in_callchain:
-            # "dalvik-jit-code-cache (deleted)[+346c] (/dev/ashmem/dalvik-jit-code-cache (deleted)[+346c])"
-            if re.search(r'\)\[\+\w+\]\)$', line):
-                break_pos = line.rfind('(', 0, line.rfind('('))
-            else:
-                break_pos = line.rfind('(')
-            if break_pos > 0:
-                m = re.match('(.+)\[\+(\w+)\]\)', line[break_pos + 1:])
-                if m:
-                    function_names.append(line[:break_pos].strip())
-                    filenames.append(m.group(1))
-                    vaddr_in_files.append(int(m.group(2), 16))
-        i += 1
-
-    for ip in ips:
-        map_entry = process_maps.find(record.pid, ip)
+                function_names.append(intern_str(line[:break_pos].strip()))
+                filenames.append(intern_str(m.group(1)))
+                vaddr_in_files.append(int(m.group(2), 16))
+
+    for map_entry in process_maps.find_all(record.pid, ips):
         if map_entry:
-            map_start_addrs.append(map_entry.start)
-            map_end_addrs.append(map_entry.end)
+            map_start_addrs.append(map_entry[0])
+            map_end_addrs.append(map_entry[1])
         else:
             map_start_addrs.append(0)
             map_end_addrs.append(0)
@@ -366,89 +478,106 @@ def parse_callchain_record(lines, i, chain_type, process_maps):
     if (None in [record.pid, record.tid] or n == 0 or len(sps) != n or
             len(function_names) != n or len(filenames) != n or len(vaddr_in_files) != n or
             len(map_start_addrs) != n or len(map_end_addrs) != n):
-        log_fatal('unexpected dump output near line %d' % i)
-    for j in range(n):
-        record.callchain.append(CallChainNode(ips[j], sps[j], filenames[j], vaddr_in_files[j],
-                                              function_names[j], map_start_addrs[j],
-                                              map_end_addrs[j]))
-    return i, record
+        log_fatal('unexpected dump output near line %d' % reader.line_num)
+    record.callchain = [CallChainNode(*node) for node in zip(
+        ips, sps, filenames, vaddr_in_files, function_names, map_start_addrs, map_end_addrs)]
+    return record
+
+
+def parse_mmap_record(reader, unwinding_report, args):
+    pid = None
+    start = None
+    end = None
+    filename = None
+    for line in reader.read_record_body():
+        if line.startswith('  pid'):
+            m = MMAP_RE.search(line)
+            if m:
+                pid = int(m.group(1))
+                start = int(m.group(2), 16)
+                end = start + int(m.group(3), 16)
+        elif line.startswith('  pgoff'):
+            pos = line.find('filename') + len('filename')
+            filename = intern_str(line[pos:].strip())
+    if None in [pid, start, end, filename]:
+        log_fatal('unexpected dump output near line %d' % reader.line_num)
+    unwinding_report.process_maps.add(pid, MapEntry(start, end, filename))
+
+
+def parse_unwinding_result_record(reader, unwinding_report, args):
+    unwinding_result = collections.OrderedDict()
+    for line in reader.read_record_body():
+        strs = line.strip().split()
+        if len(strs) == 2:
+            unwinding_result[strs[0]] = strs[1]
+    for key in ['time', 'used_time', 'stop_reason']:
+        if key not in unwinding_result:
+            log_fatal('unexpected dump output near line %d' % reader.line_num)
+    unwinding_result['used_time'] = int(unwinding_result['used_time'])
+
+    process_maps = unwinding_report.process_maps
+    sample_record = parse_sample_record(reader)
+    original_record = parse_callchain_record(reader, 'ORIGINAL_OFFLINE', process_maps)
+    joined_record = parse_callchain_record(reader, 'JOINED_OFFLINE', process_maps)
+    if args.omit_sample:
+        sample_record = []
+    sample_result = SampleResult(original_record.pid, original_record.tid,
+                                 unwinding_result, original_record.callchain,
+                                 sample_record)
+    unwinding_report.add_sample_result(sample_result, joined_record)
+
+
+def parse_fork_record(reader, unwinding_report, args):
+    pid = None
+    ppid = None
+    for line in reader.read_record_body():
+        if line.startswith('  pid'):
+            m = FORK_RE.search(line)
+            if m:
+                pid = int(m.group(1))
+                ppid = int(m.group(2))
+    if None in [pid, ppid]:
+        log_fatal('unexpected dump output near line %d' % reader.line_num)
+    unwinding_report.process_maps.fork_pid(pid, ppid)
+
+
+# Map from the record type in a record line, like "record mmap: type 1, ...", to the function
+# parsing the lines of that record.
+RECORD_PARSERS = {
+    'mmap:': parse_mmap_record,
+    'unwinding_result:': parse_unwinding_result_record,
+    'fork:': parse_fork_record,
+}
 
 
 def build_unwinding_result_report(args):
     simpleperf_path = get_host_binary_path('simpleperf')
+    # Parse the dump output while it is generated, instead of keeping all of it in memory.
     proc = subprocess.Popen([simpleperf_path, 'dump', args.record_file[0]],
-                            stdout=subprocess.PIPE)
-    (stdoutdata, _) = proc.communicate()
-    if 'debug_unwind = true' not in stdoutdata:
-        log_exit("Can't parse unwinding result. Because " +
-                 "%s was not generated by the debug-unwind cmd." % args.record_file[0])
+                            stdout=subprocess.PIPE, bufsize=1024 * 1024,
+                            universal_newlines=True)
     unwinding_report = UnwindingResultErrorReport(args.omit_callchains_fixed_by_joiner)
-    process_maps = unwinding_report.process_maps
-    lines = stdoutdata.split('\n')
-    i = 0
-    while i < len(lines):
-        if lines[i].startswith('record mmap:'):
-            i += 1
-            pid = None
-            start = None
-            end = None
-            filename = None
-            while i < len(lines) and not lines[i].startswith('record'):
-                if lines[i].startswith('  pid'):
-                    m = re.search(r'pid\s+(\d+).+addr\s+0x(\w+).+len\s+0x(\w+)', lines[i])
-                    if m:
-                        pid = int(m.group(1))
-                        start = int(m.group(2), 16)
-                        end = start + int(m.group(3), 16)
-                elif lines[i].startswith('  pgoff'):
-                    pos = lines[i].find('filename') + len('filename')
-                    filename = lines[i][pos:].strip()
-                i += 1
-            if None in [pid, start, end, filename]:
-                log_fatal('unexpected dump output near line %d' % i)
-            process_maps.add(pid, MapEntry(start, end, filename))
-        elif lines[i].startswith('record unwinding_result:'):
-            i += 1
-            unwinding_result = collections.OrderedDict()
-            while i < len(lines) and not lines[i].startswith('record'):
-                strs = (lines[i].strip()).split()
-                if len(strs) == 2:
-                    unwinding_result[strs[0]] = strs[1]
-                i += 1
-            for key in ['time', 'used_time', 'stop_reason']:
-                if key not in unwinding_result:
-                    log_fatal('unexpected dump output near line %d' % i)
-
-            i, sample_record = parse_sample_record(lines, i)
-            i, original_record = parse_callchain_record(lines, i, 'ORIGINAL_OFFLINE', process_maps)
-            i, joined_record = parse_callchain_record(lines, i, 'JOINED_OFFLINE', process_maps)
-            if args.omit_sample:
-                sample_record = []
-            sample_result = SampleResult(original_record.pid, original_record.tid,
-                                         unwinding_result, original_record.callchain,
-                                         sample_record)
-            unwinding_report.add_sample_result(sample_result, joined_record)
-        elif lines[i].startswith('record fork:'):
-            i += 1
-            pid = None
-            ppid = None
-            while i < len(lines) and not lines[i].startswith('record'):
-                if lines[i].startswith('  pid'):
-                    m = re.search(r'pid\s+(\w+),\s+ppid\s+(\w+)', lines[i])
-                    if m:
-                        pid = int(m.group(1))
-                        ppid = int(m.group(2))
-                i += 1
-            if None in [pid, ppid]:
-                log_fatal('unexpected dump output near line %d' % i)
-            process_maps.fork_pid(pid, ppid)
-        elif lines[i].startswith('    debug_unwind_mem'):
-            items = lines[i].strip().split(' = ')
+    is_debug_unwind_data = False
+    reader = DumpLineReader(proc.stdout)
+    while True:
+        line = reader.read_line()
+        if line is None:
+            break
+        if line.startswith('record '):
+            parse_record = RECORD_PARSERS.get(line[len('record '):].partition(' ')[0])
+            if parse_record:
+                parse_record(reader, unwinding_report, args)
+        elif line.startswith('    debug_unwind'):
+            items = line.strip().split(' = ')
             if len(items) == 2:
-                unwinding_report.add_mem_stat(items[0], items[1])
-            i += 1
-        else:
-            i += 1
+                if items[0] == 'debug_unwind':
+                    is_debug_unwind_data = items[1] == 'true'
+                elif items[0].startswith('debug_unwind_mem'):
+                    unwinding_report.add_mem_stat(items[0], items[1])
+    proc.wait()
+    if not is_debug_unwind_data:
+        log_exit("Can't parse unwinding result. Because " +
+                 "%s was not generated by the debug-unwind cmd." % args.record_file[0])
     return unwinding_report
 
 